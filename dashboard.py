@@ -1,149 +1,1916 @@
 import streamlit as st
 import requests
 import pandas as pd
+import numpy as np
 import altair as alt
+import html
+import functools
 import json
+import operator
 import os
+import random
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import unicodedata
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
+from email.utils import parsedate_to_datetime
+from itertools import zip_longest
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process limiting
+    fcntl = None
+try:
+    import ijson  # optional: parse package_search pages incrementally
+except ImportError:
+    ijson = None
+try:
+    import orjson  # optional: faster whole-page decoding when ijson is absent
+except ImportError:
+    orjson = None
+try:
+    from pythainlp.tokenize import word_tokenize  # optional: Thai word segmentation for search
+except ImportError:
+    word_tokenize = None
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 # === CONFIG ===
 CKAN_URL = "https://gdcatalognhic.nha.co.th"  # no trailing slash
 API_KEY = os.getenv("CKAN_API_KEY")
-headers = {"Authorization": API_KEY}
+FETCH_WORKERS = int(os.getenv("CKAN_FETCH_WORKERS", "8"))  # concurrent package_search pages
+ORG_DETAIL_THREADS = 20     # concurrent organization_show calls
+REQUEST_TIMEOUT = 15        # default seconds per CKAN call
+RETRY_BUDGET = int(os.getenv("CKAN_RETRY_BUDGET", "50"))  # retries one crawl/sync may spend in total
+# Outbound rate limit (requests/second, 0 = unlimited) with a burst allowance,
+# optional per-endpoint budgets, e.g. CKAN_RATE_LIMIT_ENDPOINTS='{"package_search": 2}',
+# and an optional lock file that shares the budget between processes.
+RATE_LIMIT = float(os.getenv("CKAN_RATE_LIMIT", "10"))
+RATE_LIMIT_BURST = int(os.getenv("CKAN_RATE_LIMIT_BURST", "20"))
+RATE_LIMIT_ENDPOINTS = json.loads(os.getenv("CKAN_RATE_LIMIT_ENDPOINTS", "{}"))
+RATE_LIMIT_LOCK_FILE = os.getenv("CKAN_RATE_LIMIT_LOCK_FILE")
+# SQLite cache of responses carrying ETag/Last-Modified, revalidated with
+# conditional requests; "" disables. Only small metadata actions are cached.
+HTTP_CACHE_FILE = os.getenv("CKAN_HTTP_CACHE", "http_cache.sqlite")
+HTTP_CACHE_ACTIONS = {"organization_list", "organization_show", "package_list", "package_show"}
+SNAPSHOT_DIR = "snapshot"
+LEGACY_CACHE_FILE = "dataset_cache.json"  # pre-snapshot cache, migrated on first load
+CHECKPOINT_DIR = "crawl_checkpoint"
+CHECKPOINT_MAX_AGE = 24 * 3600  # older checkpoints are discarded, not resumed
+ORG_CACHE_FILE = "org_cache.json"
+ORG_CACHE_TTL = 3600        # seconds, same as the in-memory org cache
+ORG_PAGE_SIZE = int(os.getenv("CKAN_ORG_PAGE_SIZE", "1000"))
+REFRESH_INTERVAL = int(os.getenv("CKAN_REFRESH_INTERVAL", "3600"))  # background refresh, seconds; 0 disables
+# package_search `fl` projection: only the Solr fields the dashboard reads.
+# Set CKAN_SEARCH_FL="" to request full package dicts.
+SEARCH_FIELDS = [f for f in os.getenv(
+    "CKAN_SEARCH_FL",
+    "id,name,title,notes,organization,license_id,metadata_modified,views_total,tags,res_format,res_name",
+).split(",") if f]
+# "offset": concurrent start= pages; "keyset": sequential pages continuing
+# from the last (metadata_modified, id), flat latency at any depth.
+PAGINATION_MODE = os.getenv("CKAN_PAGINATION", "offset")
+# "facets": Overview counts from one package_search facet query;
+# "local": count by walking the crawled datasets.
+OVERVIEW_AGGREGATION = os.getenv("CKAN_OVERVIEW_AGGREGATION", "facets")
+SNIPPET_ROWS = 50           # top search results shown with a notes excerpt
+FACET_VALUES = 200          # most common values per Explorer facet
 
 # === MANUAL CACHE REFRESH ===
 if "refresh_cache" not in st.session_state:
     st.session_state.refresh_cache = False
 
+if "sync_cache" not in st.session_state:
+    st.session_state.sync_cache = False
+
 if st.button("🔄 Refresh Dataset Cache"):
     st.session_state.refresh_cache = True
 
+if st.button("⚡ Sync Changed Datasets"):
+    st.session_state.sync_cache = True
+
 # === PAGE SETUP ===
 st.set_page_config("CKAN Dashboard", layout="wide")
 st.title("🧭 NHIC CKAN Monitoring Dashboard")
 st.markdown("Connected to: " + CKAN_URL)
 
+# === CKAN CLIENT ===
+class CircuitOpenError(requests.RequestException):
+    """Raised instead of calling CKAN while the circuit breaker is open."""
+
+class RetryBudget:
+    """Caps the retries one refresh may spend across all of its requests."""
+
+    def __init__(self, retries=RETRY_BUDGET):
+        self.remaining = retries
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+class RetryPolicy:
+    """Retry, backoff and circuit-breaker state shared by every CKAN call.
+
+    Failed calls (connection errors, timeouts, ``RETRY_STATUSES``) are
+    retried with exponential backoff and full jitter, honouring
+    ``Retry-After`` on 429/503 unless it exceeds ``max_delay``. After
+    ``failure_threshold`` consecutive failures the circuit opens and calls
+    fail fast with ``CircuitOpenError`` for ``reset_timeout`` seconds; the
+    next call then probes the server and closes it again on success.
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=30,
+                 failure_threshold=10, reset_timeout=60):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+
+    def before_call(self):
+        with self._lock:
+            if self._opened_at is not None and time.monotonic() - self._opened_at < self.reset_timeout:
+                raise CircuitOpenError("CKAN circuit breaker is open; not calling the server")
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+    def backoff(self, attempt, response=None):
+        """Seconds to wait before retry ``attempt + 1``; None means don't retry."""
+        if response is not None and response.status_code in (429, 503):
+            retry_after = _retry_after_seconds(response.headers.get("Retry-After"))
+            if retry_after is not None:
+                return retry_after if retry_after <= self.max_delay else None
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+def _retry_after_seconds(value):
+    """Parse a Retry-After header (delta-seconds or HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class TokenBucket:
+    """In-process token bucket: ``rate`` tokens/second, up to ``capacity``."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available; returns the seconds waited."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+class FileTokenBucket(TokenBucket):
+    """Token bucket whose state lives in a lock file shared by every process on the host."""
+
+    def __init__(self, rate, capacity, path, key):
+        super().__init__(rate, capacity)
+        self.path = path
+        self.key = key
+
+    def acquire(self):
+        waited = 0.0
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            with os.fdopen(fd, "r+", encoding="utf-8") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)  # released when the file is closed
+                try:
+                    state = json.loads(f.read() or "{}")
+                except ValueError:
+                    state = {}
+                now = time.time()
+                tokens, updated = state.get(self.key, (self.capacity, now))
+                tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+                delay = 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+                state[self.key] = (tokens - 1 if not delay else tokens, now)
+                f.seek(0)
+                f.truncate()
+                json.dump(state, f)
+            if not delay:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+class RateLimiter:
+    """Throttles outbound CKAN calls and keeps per-endpoint traffic metrics.
+
+    Every call takes a token from the global bucket and, if the endpoint
+    has its own budget, from that bucket too. With ``lock_file`` the
+    buckets are shared by all processes on the host (POSIX only).
+    """
+
+    def __init__(self, rate, burst, endpoint_rates=None, lock_file=None):
+        def bucket(key, bucket_rate):
+            if lock_file and fcntl is not None:
+                return FileTokenBucket(bucket_rate, burst, lock_file, key)
+            return TokenBucket(bucket_rate, burst)
+
+        self._buckets = {}
+        if rate > 0:
+            self._buckets["*"] = bucket("*", rate)
+        for endpoint, endpoint_rate in (endpoint_rates or {}).items():
+            if endpoint_rate > 0:  # like the global rate, 0 means unlimited
+                self._buckets[endpoint] = bucket(endpoint, endpoint_rate)
+        self._metrics = defaultdict(lambda: defaultdict(float))
+        self._lock = threading.Lock()
+
+    def acquire(self, endpoint):
+        waited = sum(
+            self._buckets[key].acquire() for key in ("*", endpoint) if key in self._buckets
+        )
+        self.record(endpoint, "requests")
+        if waited:
+            self.record(endpoint, "throttled")
+            self.record(endpoint, "wait_seconds", waited)
+
+    def record(self, endpoint, field, amount=1):
+        with self._lock:
+            self._metrics[endpoint][field] += amount
+
+    def metrics(self):
+        """``{endpoint: {requests, throttled, wait_seconds, retries, failures, not_modified}}``."""
+        fields = ("requests", "throttled", "wait_seconds", "retries", "failures", "not_modified")
+        with self._lock:
+            return {ep: {f: m.get(f, 0) for f in fields} for ep, m in self._metrics.items()}
+
+class HTTPResponseCache:
+    """Persistent store of CKAN responses that carry validators.
+
+    Keyed by the full request URL (action + query string). Entries keep the
+    body plus ``ETag``/``Last-Modified`` so a later request can be sent as
+    ``If-None-Match``/``If-Modified-Since`` and a 304 answered from disk.
+    """
+
+    STORED_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "url TEXT PRIMARY KEY, headers TEXT NOT NULL, body BLOB NOT NULL, stored_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        # A connection per call: cheap for SQLite and safe across threads
+        return sqlite3.connect(self.path, timeout=10)
+
+    def get(self, url):
+        """``(headers, body)`` for ``url``, or None."""
+        with self._connect() as db:
+            row = db.execute("SELECT headers, body FROM responses WHERE url = ?", (url,)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def put(self, url, response):
+        headers = {h: response.headers[h] for h in self.STORED_HEADERS if h in response.headers}
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO responses (url, headers, body, stored_at) VALUES (?, ?, ?, ?)",
+                (url, json.dumps(headers), response.content, time.time()),
+            )
+
+    @staticmethod
+    def conditional_headers(headers):
+        conditional = {}
+        if "ETag" in headers:
+            conditional["If-None-Match"] = headers["ETag"]
+        if "Last-Modified" in headers:
+            conditional["If-Modified-Since"] = headers["Last-Modified"]
+        return conditional
+
+    @staticmethod
+    def cached_response(headers, body, live):
+        """A 200 response carrying the cached body, built from the live 304."""
+        r = requests.Response()
+        r.status_code = 200
+        r.headers = CaseInsensitiveDict(headers)
+        r._content = body
+        r.url = live.url
+        r.request = live.request
+        r.encoding = "utf-8"
+        return r
+
+class CKANClient:
+    """Pooled keep-alive session for the CKAN action API.
+
+    One instance is shared by every session and worker thread (see
+    ``get_ckan_client``), so connections are reused instead of paying a
+    TCP+TLS handshake per call.
+    """
+
+    def __init__(self, base_url, api_key=None, pool_size=10, timeout=REQUEST_TIMEOUT,
+                 policy=None, limiter=None, response_cache=None):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.policy = policy or RetryPolicy()
+        self.limiter = limiter or RateLimiter(0, 1)
+        self.response_cache = response_cache
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if api_key:
+            self.session.headers["Authorization"] = api_key
+
+    def action(self, name, params=None, timeout=None, budget=None, stream=False):
+        """GET ``/api/3/action/<name>`` and return the raw response.
+
+        Actions in ``HTTP_CACHE_ACTIONS`` are revalidated against
+        ``self.response_cache``; a 304 is returned as the cached 200. With
+        ``stream`` the body is left unread (uncached actions only) and the
+        caller must close the response.
+        """
+        url = f"{self.base_url}/api/3/action/{name}"
+        if self.response_cache is None or name not in HTTP_CACHE_ACTIONS:
+            return self._get(name, url, params, timeout, budget, stream=stream)
+
+        cache_key = requests.Request("GET", url, params=params).prepare().url
+        cached = self.response_cache.get(cache_key)
+        conditional = HTTPResponseCache.conditional_headers(cached[0]) if cached else None
+        r = self._get(name, url, params, timeout, budget, conditional)
+        if r.status_code == 304 and cached:
+            self.limiter.record(name, "not_modified")
+            return HTTPResponseCache.cached_response(*cached, r)
+        if r.status_code == 200 and ("ETag" in r.headers or "Last-Modified" in r.headers):
+            self.response_cache.put(cache_key, r)
+        return r
+
+    def _get(self, name, url, params=None, timeout=None, budget=None, headers=None, stream=False):
+        """One logical GET with rate limiting and retries.
+
+        Every attempt waits for ``self.limiter``. Retries per
+        ``self.policy``; each retry also spends one unit of ``budget`` if
+        given. Returns the last response once retries are exhausted and
+        re-raises the last connection error.
+        """
+        policy = self.policy
+        attempt = 0
+        while True:
+            attempt += 1
+            if attempt > 1:
+                self.limiter.record(name, "retries")
+            policy.before_call()
+            self.limiter.acquire(name)
+            try:
+                r = self.session.get(url, params=params, headers=headers, timeout=timeout or self.timeout, stream=stream)
+            except requests.RequestException:
+                policy.record_failure()
+                self.limiter.record(name, "failures")
+                delay = policy.backoff(attempt)
+                if attempt >= policy.max_attempts or not (budget is None or budget.take()):
+                    raise
+            else:
+                if r.status_code not in policy.RETRY_STATUSES:
+                    policy.record_success()
+                    return r
+                policy.record_failure()
+                self.limiter.record(name, "failures")
+                delay = policy.backoff(attempt, r)
+                if delay is None or attempt >= policy.max_attempts or not (budget is None or budget.take()):
+                    return r
+                r.close()  # hand a streamed connection back to the pool
+            time.sleep(delay)
+
+@st.cache_resource
+def get_ckan_client():
+    # Pool sized so neither thread pool ever waits on (or discards) a connection
+    limiter = RateLimiter(RATE_LIMIT, RATE_LIMIT_BURST, RATE_LIMIT_ENDPOINTS, RATE_LIMIT_LOCK_FILE)
+    response_cache = HTTPResponseCache(HTTP_CACHE_FILE) if HTTP_CACHE_FILE else None
+    return CKANClient(
+        CKAN_URL, API_KEY, pool_size=max(FETCH_WORKERS, ORG_DETAIL_THREADS),
+        limiter=limiter, response_cache=response_cache,
+    )
+
+# === REQUEST COALESCING ===
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one execution.
+
+    The first caller (the leader) runs the function; callers arriving while
+    it is in flight block on the same future and share its result. If the
+    leader fails, or its session is interrupted by a rerun, a waiting
+    caller takes over instead of propagating the leader's exception.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def in_flight(self, key):
+        return key in self._inflight
+
+    def do(self, key, fn, *args):
+        while True:
+            with self._lock:
+                future = self._inflight.get(key)
+                if future is None:
+                    future = self._inflight[key] = Future()
+                    break
+            try:
+                return future.result()
+            except BaseException:
+                continue
+
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        return result
+
+@st.cache_resource
+def get_single_flight():
+    return SingleFlight()
+
+def _coalesced(key, fn, *args):
+    """Run ``fn`` through the process-wide SingleFlight, telling followers why they wait."""
+    flight = get_single_flight()
+    if flight.in_flight(key):
+        st.info("⏳ Another session is already fetching this from CKAN; sharing its result...")
+    return flight.do(key, fn, *args)
+
 # === API WRAPPERS ===
 @st.cache_data(ttl=600)
 def get_organizations():
-    r = requests.get(f"{CKAN_URL}/api/3/action/organization_list", headers=headers)
+    try:
+        r = get_ckan_client().action("organization_list")
+    except requests.RequestException:
+        return []
     if r.status_code == 200:
         return r.json()["result"]
     return []
 
-@st.cache_data(ttl=600)
-def get_datasets():
-    r = requests.get(f"{CKAN_URL}/api/3/action/package_list", headers=headers)
-    if r.status_code == 200:
-        return r.json()["result"]
-    return []
+def iter_package_names(page_size=1000):
+    """Yield every public dataset slug, paging package_list with limit/offset.
+
+    Raises ``requests.HTTPError`` if a page fails, so a partial list is
+    never mistaken for the whole catalog. Use get_dataset_count() for totals.
+    """
+    client = get_ckan_client()
+    offset = 0
+    while True:
+        r = client.action("package_list", {"limit": page_size, "offset": offset})
+        r.raise_for_status()
+        names = r.json()["result"]
+        yield from names
+        if len(names) < page_size:
+            return
+        offset += len(names)
 
 @st.cache_data(ttl=600)     #cache dataset_details
 def get_dataset_detail(dataset_id):
-    r = requests.get(f"{CKAN_URL}/api/3/action/package_show?id={dataset_id}", headers=headers)
+    try:
+        r = get_ckan_client().action("package_show", {"id": dataset_id})
+    except requests.RequestException:
+        return None
     if r.status_code == 200:
         return r.json()["result"]
     return None
 
 @st.cache_data(ttl=600)     #cache org_datails
 def get_org_detail(org_id):
-    r = requests.get(f"{CKAN_URL}/api/3/action/organization_show?id={org_id}", headers=headers)
+    try:
+        r = get_ckan_client().action("organization_show", {"id": org_id})
+    except requests.RequestException:
+        return None
     if r.status_code == 200:
         return r.json()["result"]
     return None
 
-@st.cache_data(ttl=3600)    #cache search_datasets
-def get_dataset_count(): # Always get the total first
-    url = f"{CKAN_URL}/api/3/action/package_search"
-    params = {"rows": 0}  # We just want metadata
-    r = requests.get(url, headers=headers, params=params, timeout=10)
+@st.cache_data(ttl=600)     #cache dataset totals
+def get_dataset_count(include_private=False, include_drafts=False):
+    # rows=0: just the hit count, no dataset payload. Private and draft
+    # datasets are only counted when asked for (and visible to API_KEY).
+    params = {"rows": 0}
+    if include_private:
+        params["include_private"] = "true"
+    if include_drafts:
+        params["include_drafts"] = "true"
+    try:
+        r = get_ckan_client().action("package_search", params, timeout=10)
+    except requests.RequestException:
+        return 0
     if r.status_code == 200:
         return r.json()["result"]["count"]
     return 0
-def _search_datasets_paginated_reliable(limit=10000):
-    url = f"{CKAN_URL}/api/3/action/package_search"
+
+@st.cache_data(ttl=600)
+def get_search_facets(fields=("organization", "tags", "res_format")):
+    """Catalog-wide facet counts from a single ``rows=0`` package_search.
+
+    Returns ``{field: [{"name", "display_name", "count"}, ...]}``, or None if
+    the request fails or the server omits any requested facet.
+    """
+    params = {"rows": 0, "facet.field": json.dumps(list(fields)), "facet.limit": -1}
+    try:
+        r = get_ckan_client().action("package_search", params)
+    except requests.RequestException:
+        return None
+    if r.status_code != 200:
+        return None
+    facets = r.json()["result"].get("search_facets") or {}
+    if not all(f in facets for f in fields):
+        return None
+    return {f: facets[f].get("items", []) for f in fields}
+
+def _search_count(fq=None):
+    """Uncached package_search hit count; None if the request fails."""
+    params = {"rows": 0}
+    if fq:
+        params["fq"] = fq
+    try:
+        r = get_ckan_client().action("package_search", params, timeout=10)
+    except requests.RequestException:
+        return None
+    if r.status_code == 200:
+        return r.json()["result"]["count"]
+    return None
+
+@dataclass(slots=True, frozen=True)
+class OrgRef:
+    name: str
+    title: str | None = None
+
+@dataclass(slots=True, frozen=True)
+class ResourceRecord:
+    name: str | None
+    format: str
+
+@dataclass(slots=True, frozen=True)
+class DatasetRecord:
+    """The fields of a CKAN package the dashboard reads, and nothing else.
+
+    Slotted and flat (tags are plain strings), so a crawled catalog costs a
+    fraction of the nested package dicts it is decoded from.
+    """
+    id: str
+    name: str | None
+    title: str | None
+    notes: str | None
+    license_id: str | None
+    organization: OrgRef | None
+    metadata_modified: str | None
+    views: int
+    tags: tuple[str, ...]
+    resources: tuple[ResourceRecord, ...]
+
+    @classmethod
+    def decode(cls, d):
+        """Build a record from a package dict, an ``fl``-projected Solr
+        document (org slug, tag/format name lists, ``views_total``) or
+        ``to_json`` output. Raises ValueError for rows it cannot trust.
+
+        Projected rows carry no org title; it is resolved from the org list
+        when the snapshot is written.
+        """
+        if not isinstance(d, dict) or not isinstance(d.get("id"), str) or not d["id"]:
+            raise ValueError("dataset row without an id")
+        modified = d.get("metadata_modified")
+        if modified is not None and not isinstance(modified, str):
+            raise ValueError(f"dataset {d['id']}: bad metadata_modified {modified!r}")
+
+        org = d.get("organization")
+        if isinstance(org, str):
+            org = OrgRef(org)
+        elif isinstance(org, dict) and org.get("name"):
+            org = OrgRef(org["name"], org.get("title"))
+        else:
+            org = None
+
+        if "resources" in d:
+            resources = tuple(ResourceRecord(r.get("name"), r.get("format", "unknown")) for r in d["resources"] or [])
+        else:
+            resources = tuple(
+                ResourceRecord(name, fmt)
+                for name, fmt in zip_longest(d.get("res_name") or [], d.get("res_format") or [], fillvalue="")
+            )
+
+        tags = (t if isinstance(t, str) else t.get("name") for t in d.get("tags") or [])
+        if "tracking_summary" in d:
+            views = (d["tracking_summary"] or {}).get("total", 0)
+        else:
+            views = d.get("views_total", d.get("views"))
+
+        return cls(
+            id=d["id"],
+            name=d.get("name"),
+            title=d.get("title"),
+            notes=d.get("notes") or None,
+            license_id=d.get("license_id") or None,
+            organization=org,
+            metadata_modified=(modified.rstrip("Z") or None) if modified else None,
+            views=int(views or 0),
+            tags=tuple(t for t in tags if t),
+            resources=resources,
+        )
+
+    def to_json(self):
+        return asdict(self)
+
+def _iter_search_results(r):
+    """Yield the raw result dicts of a streamed package_search response.
+
+    With ijson each result is parsed off the socket one at a time, so a
+    caller that decodes as it goes never holds more than one raw package.
+    Otherwise the page is decoded in one go (with orjson if installed).
+    """
+    if ijson is not None:
+        r.raw.decode_content = True
+        yield from ijson.items(r.raw, "result.results.item", use_float=True)
+        return
+    payload = orjson.loads(r.content) if orjson is not None else r.json()
+    yield from payload["result"].get("results", [])
+
+def _fetch_search_page(client, params, budget=None):
+    """Fetch one package_search page; the client handles retries.
+
+    Returns ``(results, errors)``; ``results`` is None if the page could not
+    be fetched or parsed. Rows come back as ``DatasetRecord``s decoded
+    straight off the socket (see ``_iter_search_results``); malformed rows
+    are dropped and reported in ``errors``. If the server rejects the ``fl``
+    projection the page is requested again without it. Runs in worker
+    threads, so it must not touch Streamlit elements.
+    """
+    errors = []
+    while True:
+        try:
+            r = client.action("package_search", params, budget=budget, stream=True)
+        except Exception as e:
+            errors.append(str(e))
+            return None, errors
+        with r:
+            if r.status_code == 200:
+                results, invalid = [], 0
+                try:
+                    for d in _iter_search_results(r):
+                        try:
+                            results.append(DatasetRecord.decode(d))
+                        except (TypeError, ValueError, AttributeError):
+                            invalid += 1
+                except Exception as e:
+                    errors.append(f"unreadable response: {e}")
+                    return None, errors
+                if invalid:
+                    errors.append(f"skipped {invalid} malformed rows")
+                return results, errors
+        errors.append(f"HTTP {r.status_code}")
+        if r.status_code in (400, 409) and "fl" in params:
+            params = {k: v for k, v in params.items() if k != "fl"}
+            continue
+        return None, errors
+
+class StreamlitCrawlReporter:
+    """Shows crawl progress with Streamlit elements (script thread only)."""
+
+    def start(self, header):
+        st.write(header)
+        self._bar = st.progress(0, text="🔍 Loading datasets...")
+        self._log = st.empty()
+
+    def progress(self, fraction, text):
+        self._bar.progress(fraction, text=text)
+
+    def warning(self, message):
+        self._log.warning(message)
+
+    def clear_warning(self):
+        self._log.empty()
+
+    def error(self, message):
+        st.error(message)
+
+    def finish(self):
+        self._bar.empty()
+
+class LogCrawlReporter:
+    """Collects crawl messages for crawls running off the script thread."""
+
+    def __init__(self):
+        self.messages = []
+        self.errors = []
+
+    def start(self, header):
+        self.messages.append(header)
+
+    def progress(self, fraction, text):
+        pass
+
+    def warning(self, message):
+        self.messages.append(message)
+
+    def clear_warning(self):
+        pass
+
+    def error(self, message):
+        self.messages.append(message)
+        self.errors.append(message)
+
+    def finish(self):
+        pass
+
+def _start_crawl(reporter, fq=None):
+    """Fetch a fresh hit count for the crawl and announce it; returns the count."""
+    total_count = _search_count(fq) or 0
+    if fq:
+        reporter.start(f"📦 Datasets changed since last sync: {total_count:,}")
+    else:
+        reporter.start(f"📦 Total datasets from CKAN: {total_count:,}")
+    return total_count
+
+class CrawlCheckpoint:
+    """Completed pages of a full crawl, kept on disk until the crawl completes.
+
+    Resuming an interrupted or partly failed crawl re-fetches only the
+    missing pages. A checkpoint is only reused for a crawl with identical
+    ``params`` (paging mode, query, and for offset paging the hit count,
+    since offsets shift when it changes) and within ``CHECKPOINT_MAX_AGE``.
+    """
+
+    def __init__(self, root, params):
+        self.root = root
+        meta = self._read_json(os.path.join(root, "meta.json"))
+        if (meta is None or meta.get("params") != params
+                or time.time() - meta.get("started_at", 0) > CHECKPOINT_MAX_AGE):
+            self.discard(root)
+            os.makedirs(root)
+            self._write_json(os.path.join(root, "meta.json"), {"params": params, "started_at": time.time()})
+
+    def load_pages(self):
+        """Yield ``(page, rows)`` for every page saved so far, in page order."""
+        for entry in sorted(os.listdir(self.root)):
+            if entry.startswith("page-") and entry.endswith(".json"):
+                rows = self._read_json(os.path.join(self.root, entry))
+                try:
+                    yield int(entry[5:-5]), [DatasetRecord.decode(d) for d in rows]
+                except (TypeError, ValueError, AttributeError):
+                    continue  # unreadable page: fetch it again
+
+    def drop_pages(self, start):
+        """Delete saved pages from ``start`` on."""
+        for entry in os.listdir(self.root):
+            if entry.startswith("page-") and entry.endswith(".json") and int(entry[5:-5]) >= start:
+                os.remove(os.path.join(self.root, entry))
+
+    def save_page(self, page, rows):
+        self._write_json(os.path.join(self.root, f"page-{page:06d}.json"), [d.to_json() for d in rows])
+
+    @staticmethod
+    def discard(root=CHECKPOINT_DIR):
+        shutil.rmtree(root, ignore_errors=True)
+
+    @staticmethod
+    def _read_json(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_json(path, data):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+def _keyset_key(d):
+    return (_solr_date(d.metadata_modified), d.id)
+
+def _keyset_fq(last):
+    """Solr filter for rows strictly after ``last`` in (metadata_modified, id) order."""
+    ts = _solr_date(last.metadata_modified)
+    return f'metadata_modified:{{{ts} TO *] OR (metadata_modified:"{ts}" AND id:{{"{last.id}" TO *])'
+
+def _search_datasets_keyset(limit=None, fq=None, reporter=None):
+    """Crawl package_search with keyset pagination.
+
+    Each page is sorted by ``metadata_modified asc, id asc`` and filtered to
+    rows after the last key seen, so Solr never skips over deep offsets and
+    concurrent edits cannot shift rows between pages. Pages are inherently
+    sequential; on failure the rows fetched so far are a valid prefix.
+    Returns a ``SnapshotBuilder``; ``limit`` is rounded up to whole pages.
+    """
+    client = get_ckan_client()
+    budget = RetryBudget()
     rows_per_page = 1000
-    all_results = []
-    total_count = get_dataset_count()
-    st.write(f"📦 Total datasets from CKAN: {total_count:,}")
-    total_pages = (min(limit, total_count) + rows_per_page - 1) // rows_per_page
+    base_params = {"rows": rows_per_page, "sort": "metadata_modified asc, id asc"}
+    if SEARCH_FIELDS:
+        base_params["fl"] = ",".join(dict.fromkeys(SEARCH_FIELDS + ["id", "metadata_modified"]))
+    reporter = reporter or StreamlitCrawlReporter()
+    total_count = _start_crawl(reporter, fq)
+    if limit is not None:
+        total_count = min(limit, total_count)
 
-    progress = st.progress(0, text="🔍 Loading datasets...")
-    log_area = st.empty()
+    # Full crawls resume after the last checkpointed page
+    checkpoint = None if fq else CrawlCheckpoint(CHECKPOINT_DIR, {"mode": "keyset", "params": base_params})
+    builder = SnapshotBuilder()
+    last = None
+    for page, rows in (checkpoint.load_pages() if checkpoint else ()):
+        if page != builder.num_pages:
+            # A page before this one is missing or unreadable; resume after
+            # the contiguous prefix and drop the rest so it is refetched
+            checkpoint.drop_pages(builder.num_pages)
+            break
+        builder.add_page(page, rows)
+        last = rows[-1] if rows else last
+    page = builder.num_pages
+    if page:
+        reporter.progress(min(builder.num_rows / max(total_count, 1), 1.0), f"♻️ Resuming after page {page}")
+    while limit is None or builder.num_rows < limit:
+        filters = [f"({fq})"] if fq else []
+        if last:
+            filters.append(f"({_keyset_fq(last)})")
+        params = dict(base_params, fq=" AND ".join(filters)) if filters else base_params
+        results, errors = _fetch_search_page(client, params, budget)
+        if results is None:
+            reporter.error(f"❌ Failed to fetch page {page+1}: {errors[-1]}")
+            break
+        if errors:
+            reporter.warning(f"⚠️ Page {page+1} {errors[-1]}")
+        else:
+            reporter.clear_warning()
+        if last and results and _keyset_key(results[-1]) <= _keyset_key(last):
+            # Server ignored the key filter; paging on would loop forever
+            reporter.error(f"❌ Keyset pagination made no progress at page {page+1}; stopping.")
+            break
+        if checkpoint:
+            checkpoint.save_page(page, results)
+        builder.add_page(page, results)
+        last = results[-1] if results else last
+        page += 1
+        reporter.progress(min(builder.num_rows / max(total_count, 1), 1.0), f"🔍 Loaded page {page}")
+        if len(results) < rows_per_page:
+            builder.finished = True
+            break
+    reporter.finish()
+    return builder
 
-    for page in range(total_pages):
-        offset = page * rows_per_page
-        success = False
-        retries = 3
+def _search_datasets_paginated_reliable(limit=None, max_workers=FETCH_WORKERS, fq=None, reporter=None):
+    if PAGINATION_MODE == "keyset":
+        return _search_datasets_keyset(limit=limit, fq=fq, reporter=reporter)
+    client = get_ckan_client()
+    budget = RetryBudget()
+    rows_per_page = 1000
+    # A stable order, so checkpointed offsets mean the same rows on resume;
+    # for a sync, oldest change first keeps a partial result a valid prefix
+    base_params = {"rows": rows_per_page, "sort": "metadata_modified asc, id asc"}
+    if SEARCH_FIELDS:
+        base_params["fl"] = ",".join(SEARCH_FIELDS)
+    if fq:
+        base_params["fq"] = fq
+    reporter = reporter or StreamlitCrawlReporter()
+    total_count = _start_crawl(reporter, fq)
+    if limit is not None:
+        total_count = min(limit, total_count)
+    total_pages = (total_count + rows_per_page - 1) // rows_per_page
 
-        for attempt in range(1, retries + 1):
-            try:
-                params = {"rows": rows_per_page, "start": offset}
-                r = requests.get(url, headers=headers, params=params, timeout=15)
-                if r.status_code == 200:
-                    results = r.json()["result"].get("results", [])
-                    all_results.extend(results)
-                    success = True
-                    break
+    # Full crawls skip pages already checkpointed by an earlier attempt
+    checkpoint = None if fq else CrawlCheckpoint(
+        CHECKPOINT_DIR, {"mode": "offset", "params": base_params, "total": total_count}
+    )
+    builder = SnapshotBuilder()
+    for page, rows in (checkpoint.load_pages() if checkpoint else ()):
+        builder.add_page(page, rows)
+    pending = [page for page in range(total_pages) if page not in builder]
+    page_errors = {}
+    if builder.num_pages:
+        reporter.progress(builder.num_pages / max(total_pages, 1), f"♻️ Resuming: {builder.num_pages}/{total_pages} pages already fetched")
+
+    def fetch_page(page):
+        results, errors = _fetch_search_page(client, {**base_params, "start": page * rows_per_page}, budget)
+        # Checkpointed by the worker, so finished pages survive an interrupted crawl
+        if results is not None and checkpoint:
+            checkpoint.save_page(page, results)
+        return results, errors
+
+    # Pages are fetched concurrently and complete in any order; progress and
+    # logging stay on the calling thread.
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {executor.submit(fetch_page, page): page for page in pending}
+        try:
+            for future in as_completed(futures):
+                page = futures[future]
+                results, errors = future.result()
+                if results is None:
+                    failed.append(page)
+                    page_errors[page] = errors[-1]
                 else:
-                    log_area.warning(f"⚠️ Page {page+1} attempt {attempt}: HTTP {r.status_code}")
-            except Exception as e:
-                log_area.warning(f"⚠️ Page {page+1} attempt {attempt}: {e}")
+                    builder.add_page(page, results)
+                if errors:
+                    reporter.warning(f"⚠️ Page {page+1} {errors[-1]}")
+                done = builder.num_pages + len(failed)
+                reporter.progress(done / max(total_pages, 1), f"🔍 Loaded page {done}/{total_pages}")
+        except BaseException:
+            # e.g. Streamlit's rerun/stop raised from the reporter: drop the
+            # queued pages instead of fetching them on the way out
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
 
-        progress.progress((page + 1) / total_pages, text=f"🔍 Loaded page {page+1}/{total_pages}")
+    # A sync stops at the first missing page so its result stays a
+    # contiguous prefix; a full crawl keeps every page it has.
+    for page in range(total_pages):
+        if page not in builder:
+            reporter.error(f"❌ Failed to fetch page {page+1}: {page_errors.get(page, 'not fetched')}")
+            if fq:
+                builder.truncate(page)
+                break
+    builder.finished = all(page in builder for page in range(total_pages))
+    if not failed:
+        reporter.clear_warning()
+    reporter.finish()
+    return builder
 
-        if not success:
-            st.error(f"❌ Failed to fetch page {page+1} after {retries} attempts.")
-            break
+def _solr_date(ts):
+    """CKAN timestamp (naive UTC, microseconds) -> Solr date literal (ms, Z)."""
+    return ts.rstrip("Z")[:23] + "Z"
+
+# === SEARCH INDEX ===
+THAI_RUN = re.compile(r"[\u0e00-\u0e7f]+")
+THAI_TONE_MARKS = dict.fromkeys(map(ord, "\u0e48\u0e49\u0e4a\u0e4b"), None)  # mai ek .. mai chattawa
+WHITESPACE = re.compile(r"[^\S\n]+")
+
+def _segment_thai(text):
+    """Space-separate the words of Thai runs (no-op without pythainlp)."""
+    if word_tokenize is None:
+        return text
+    return THAI_RUN.sub(lambda m: " ".join(word_tokenize(m.group(), engine="newmm", keep_whitespace=False)), text)
+
+def _search_key(text):
+    """Normalize text for matching; applied to index keys and queries alike.
+
+    NFC and casefold, Thai words split apart, tone marks dropped (so a
+    query typed without them still matches) and the two spellings of
+    sara am unified.
+    """
+    if not isinstance(text, str):
+        return ""
+    return _normalize(_segment_thai(unicodedata.normalize("NFC", text)))
+
+def _normalize(text):
+    """``_search_key`` without the segmentation, for text already split into words."""
+    text = unicodedata.normalize("NFC", text).casefold()
+    text = text.translate(THAI_TONE_MARKS).replace("\u0e4d\u0e32", "\u0e33")
+    return WHITESPACE.sub(" ", text).strip()
+
+@functools.lru_cache(maxsize=256)
+def _query_terms(query):
+    """Normalized terms of an Explorer query, segmented once per query string."""
+    return tuple(_search_key(query).split())
+
+FIELD_SEPARATOR = "\x1f"
+
+def _fill_search_keys(tables):
+    """Compute ``search_key`` and ``text_key`` for dataset rows that lack them.
+
+    ``search_key`` is the normalized title and organization title on two
+    lines; ``text_key`` holds the normalized tags, resource names and
+    notes, separated by ``FIELD_SEPARATOR``. Runs before a snapshot is
+    written, so rows carried over by a sync keep the keys they already
+    have.
+    """
+    datasets = tables["datasets"]
+    missing = datasets["search_key"].isna() | datasets["text_key"].isna()
+    if missing.any():
+        ids = datasets.loc[missing, "id"]
+        org_keys = {name: _search_key(title) for name, title in zip(tables["orgs"]["name"], tables["orgs"]["title"])}
+        titles = datasets.loc[missing, "title"].map(_search_key)
+        orgs = datasets.loc[missing, "org_id"].map(org_keys).fillna("")
+        fields = []
+        for name, column in (("tags", "tag"), ("resources", "name")):
+            child = tables[name][tables[name]["dataset_id"].isin(ids)].dropna(subset=[column])
+            joined = child.groupby("dataset_id")[column].agg(" ".join)
+            fields.append(ids.map(joined).fillna("").map(_search_key))
+        fields.append(datasets.loc[missing, "notes"].map(_search_key))
+        datasets = datasets.copy()
+        datasets.loc[missing, "search_key"] = titles + "\n" + orgs
+        datasets.loc[missing, "text_key"] = fields[0] + FIELD_SEPARATOR + fields[1] + FIELD_SEPARATOR + fields[2]
+    return dict(tables, datasets=datasets)
+
+def _index_terms(key):
+    """Terms of a normalized key: its words, with Thai runs that could not
+    be segmented (no pythainlp) split into overlapping trigrams."""
+    terms = []
+    for word in key.split():
+        if word_tokenize is None and len(word) > TrigramIndex.GRAM and THAI_RUN.search(word):
+            terms.extend(word[i:i + TrigramIndex.GRAM] for i in range(len(word) - TrigramIndex.GRAM + 1))
         else:
-            log_area.empty() 
-    progress.empty()
-    return all_results
+            terms.append(word)
+    return terms
 
-def search_datasets_paginated(limit=10000):
-    cache_file = "dataset_cache.json"
+def _snippet(text, terms, width=12, mark=("**", "**")):
+    """A window of ``text`` around its first word matching any of ``terms``, matches marked; "" if none."""
+    if not isinstance(text, str) or not terms:
+        return ""
+    words = _segment_thai(text).split()
+    hits = [any(term in _normalize(word) for term in terms) for word in words]
+    if not any(hits):
+        return ""
+    start = max(0, hits.index(True) - width // 3)
+    stop = min(len(words), start + width)
+    window = [f"{mark[0]}{words[i]}{mark[1]}" if hits[i] else words[i] for i in range(start, stop)]
+    return ("… " if start else "") + " ".join(window) + (" …" if stop < len(words) else "")
 
-    if st.session_state.refresh_cache:
-        st.session_state.refresh_cache = False
-        if os.path.exists(cache_file):
-            os.remove(cache_file)
-        st.cache_data.clear()
+class TrigramIndex:
+    """Substring search over one normalized key per row.
+
+    Each key is split into overlapping 3-character grams with a posting
+    list of row ids per gram. A query intersects the postings of its own
+    grams, shortest first, and only the few surviving candidates are
+    checked with a real substring test, so results match ``str.contains``
+    without scanning every row.
+    """
+
+    GRAM = 3
+
+    def __init__(self, keys):
+        self.keys = list(keys)
+        postings = defaultdict(list)
+        for row, key in enumerate(self.keys):
+            for gram in {key[i:i + self.GRAM] for i in range(len(key) - self.GRAM + 1)}:
+                postings[gram].append(row)
+        self.postings = {gram: np.array(rows, dtype=np.int32) for gram, rows in postings.items()}
+
+    def search(self, query):
+        """Sorted row ids whose key contains ``query`` (one normalized term)."""
+        if len(query) < self.GRAM:
+            # Too short to have a gram; a plain scan is still cheap
+            return np.flatnonzero([query in key for key in self.keys])
+        grams = {query[i:i + self.GRAM] for i in range(len(query) - self.GRAM + 1)}
+        lists = sorted((self.postings.get(gram) for gram in grams), key=lambda rows: -1 if rows is None else len(rows))
+        if lists[0] is None:
+            return np.empty(0, dtype=np.int32)
+        candidates = lists[0]
+        for rows in lists[1:]:
+            candidates = np.intersect1d(candidates, rows, assume_unique=True)
+            if not len(candidates):
+                break
+        return candidates[[query in self.keys[row] for row in candidates]]
+
+class BM25Index:
+    """Okapi BM25 over several weighted text fields per row.
+
+    Term frequencies are summed across fields scaled by ``weights`` (a
+    title hit counts more than a notes hit) and postings are kept as NumPy
+    arrays, so a query is a few vectorized updates per term. Every query
+    term must occur in a row for it to match.
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, docs, weights):
+        postings = defaultdict(lambda: ([], []))
+        lengths = []
+        for row, fields in enumerate(docs):
+            frequencies = defaultdict(float)
+            length = 0.0
+            for key, weight in zip(fields, weights):
+                terms = _index_terms(key)
+                for term in terms:
+                    frequencies[term] += weight
+                length += weight * len(terms)
+            for term, frequency in frequencies.items():
+                postings[term][0].append(row)
+                postings[term][1].append(frequency)
+            lengths.append(length)
+        self.size = len(lengths)
+        self.postings = {
+            term: (np.array(rows, dtype=np.int32), np.array(tf, dtype=np.float32))
+            for term, (rows, tf) in postings.items()
+        }
+        lengths = np.array(lengths, dtype=np.float32)
+        self._norm = self.K1 * (1 - self.B + self.B * lengths / max(lengths.mean(), 1.0)) if self.size else lengths
+
+    def search(self, terms):
+        """``(rows, scores)`` of rows containing every term, best first."""
+        terms = set(terms)
+        if not terms or any(term not in self.postings for term in terms):
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        scores = np.zeros(self.size, dtype=np.float32)
+        matched = np.zeros(self.size, dtype=np.int16)
+        for term in terms:
+            rows, tf = self.postings[term]
+            idf = np.log1p((self.size - len(rows) + 0.5) / (len(rows) + 0.5))
+            scores[rows] += idf * tf * (self.K1 + 1) / (tf + self._norm[rows])
+            matched[rows] += 1
+        hits = np.flatnonzero(matched == len(terms))
+        order = hits[np.argsort(-scores[hits], kind="stable")]
+        return order, scores[order]
+
+# === QUERY LANGUAGE ===
+QUERY_TERM = re.compile(r'(?<!\S)(-?)(\w+):(>=|<=|>|<|=)?("[^"]*"|\S+)')
+QUERY_FIELDS = {
+    "org": "org", "organization": "org", "tag": "tag", "format": "format",
+    "modified": "modified", "views": "views", "resources": "resources",
+}
+RANGE_FIELDS = {"modified", "views", "resources"}
+
+@dataclass(slots=True, frozen=True)
+class QueryFilter:
+    field: str
+    op: str
+    values: tuple[str, ...]  # any of them may match
+    negate: bool = False
 
-    if os.path.exists(cache_file):
+@dataclass(slots=True, frozen=True)
+class ParsedQuery:
+    text: str
+    filters: tuple[QueryFilter, ...]
+    errors: tuple[str, ...]
+
+@functools.lru_cache(maxsize=256)
+def parse_query(text):
+    """Split Explorer input into ``field:value`` filters and free text.
+
+    ``org:moph format:csv,xlsx tag:"open data" modified:>2024-01-01
+    views:>=100 -tag:test``: commas OR values, a leading ``-`` negates,
+    and ``modified``/``views``/``resources`` take ``> >= < <= =``. Dates
+    may be partial (``modified:2024-03`` is the whole month). Unknown
+    fields stay part of the free text; invalid filters are reported in
+    ``errors`` and dropped.
+    """
+    filters, errors = [], []
+
+    def take(match):
+        negate, name, op, value = match.groups()
+        field = QUERY_FIELDS.get(name.lower())
+        if field is None:
+            return match.group(0)
+        values = tuple(v.strip() for v in value.strip('"').split(",") if v.strip())
         try:
-            with open(cache_file, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except:
-            os.remove(cache_file)
+            if not values:
+                raise ValueError("missing value")
+            if op and field not in RANGE_FIELDS:
+                raise ValueError(f"{name} only supports exact values")
+            if field == "modified":
+                for v in values:
+                    pd.Period(v)
+            elif field in ("views", "resources"):
+                for v in values:
+                    int(v)
+        except ValueError as e:
+            errors.append(f"{match.group(0)} ({e})")
+        else:
+            filters.append(QueryFilter(field, op or "=", values, bool(negate)))
+        return ""
+
+    text = QUERY_TERM.sub(take, text)
+    return ParsedQuery(" ".join(text.split()), tuple(filters), tuple(errors))
+
+# === FACETS ===
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def _popcount(packed):
+    """Set bits per byte of a packed bitmap array."""
+    return np.bitwise_count(packed) if hasattr(np, "bitwise_count") else _POPCOUNT[packed]
+
+class FacetIndex:
+    """Bit-packed row bitmaps for the values of one facet.
+
+    Only the ``limit`` most common values get a bitmap (rarer ones are
+    still reachable through the query language). Selections OR bitmaps
+    within a facet and AND them across facets; counts are popcounts of a
+    bitmap ANDed with the current selection. Values are listed most common
+    first, or in ``labels`` order with ``keep_order``.
+    """
+
+    def __init__(self, rows, codes, labels, size, limit=FACET_VALUES, keep_order=False):
+        rows, codes = np.asarray(rows), np.asarray(codes)
+        known = codes >= 0
+        rows, codes = rows[known], codes[known]
+        totals = np.bincount(codes, minlength=len(labels))
+        order = np.argsort(-totals, kind="stable")[:limit]
+        order = order[totals[order] > 0]
+        if keep_order:
+            order = np.sort(order)
+        self.values = [labels[code] for code in order]
+        self.size = size
+
+        slot = np.full(len(labels), -1)
+        slot[order] = np.arange(len(order))
+        kept = slot[codes] >= 0
+        dense = np.zeros((len(order), size), dtype=bool)
+        dense[slot[codes[kept]], rows[kept]] = True
+        self.bitmaps = np.packbits(dense, axis=1)
+        self._slots = {value: i for i, value in enumerate(self.values)}
+
+    def select(self, values):
+        """Packed bitmap of rows having any of ``values``."""
+        slots = [self._slots[value] for value in values if value in self._slots]
+        if not slots:
+            return np.zeros(self.bitmaps.shape[1], dtype=np.uint8)
+        return np.bitwise_or.reduce(self.bitmaps[slots], axis=0)
+
+    def counts(self, packed_mask):
+        """Rows per value within ``packed_mask``, in ``values`` order."""
+        return _popcount(self.bitmaps & packed_mask).sum(axis=1)
+
+# === SNAPSHOT STORE ===
+SNAPSHOT_COLUMNS = {
+    "datasets": [
+        "id", "name", "title", "notes", "license_id", "org_id", "metadata_modified", "views", "num_resources",
+        "search_key", "text_key",
+    ],
+    "resources": ["dataset_id", "name", "format"],
+    "tags": ["dataset_id", "tag"],
+    "orgs": ["name", "title"],
+}
+
+class SnapshotStore:
+    """Normalized catalog tables as Parquet files, one directory per generation.
+
+    ``CURRENT`` is a small JSON manifest naming the live generation. It is
+    replaced atomically once a new generation is fully written, so readers
+    never see a half-written snapshot. Reads may be restricted to the
+    columns a caller needs. Search keys depend on whether pythainlp is
+    installed, so a snapshot written in the other mode is treated like one
+    from an older schema and rebuilt.
+    """
+
+    SCHEMA_VERSION = 4
+    KEEP_GENERATIONS = 2  # the previous one may still be open in another session
+
+    def __init__(self, root=SNAPSHOT_DIR):
+        self.root = root
+        self.current_path = os.path.join(root, "CURRENT")
+
+    def manifest(self):
+        """The live manifest, or None if there is no usable snapshot."""
+        try:
+            with open(self.current_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get("schema_version") != self.SCHEMA_VERSION:
+            return None
+        if manifest.get("thai_segmentation") != (word_tokenize is not None):
+            return None
+        return manifest
+
+    def read(self, table, columns=None, manifest=None):
+        manifest = manifest or self.manifest()
+        path = os.path.join(self.root, manifest["generation"], f"{table}.parquet")
+        return pq.read_table(path, columns=columns).to_pandas()
+
+    def write(self, tables, **meta):
+        """Write ``tables`` as a new generation, publish it and return its manifest."""
+        generation = f"gen-{time.time_ns()}"
+        gen_dir = os.path.join(self.root, generation)
+        os.makedirs(gen_dir)
+        for name, columns in SNAPSHOT_COLUMNS.items():
+            table = pa.Table.from_pandas(tables[name][columns], preserve_index=False)
+            pq.write_table(table, os.path.join(gen_dir, f"{name}.parquet"))
+
+        manifest = {
+            "schema_version": self.SCHEMA_VERSION,
+            "thai_segmentation": word_tokenize is not None,
+            "generation": generation,
+            "created_at": time.time(),
+            **meta,
+        }
+        tmp_path = f"{self.current_path}.{generation}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.current_path)
+        self._prune()
+        return manifest
+
+    def _prune(self):
+        generations = sorted(e for e in os.listdir(self.root) if e.startswith("gen-"))
+        for entry in generations[:-self.KEEP_GENERATIONS]:
+            shutil.rmtree(os.path.join(self.root, entry), ignore_errors=True)
+
+DATASET_DTYPES = {
+    "title": "string",
+    "name": "string",
+    "organization": "category",
+    "org_id": "category",
+    "resources": "Int32",
+    "last_modified": "datetime64[ns, UTC]",
+    "views": "Int64",
+}
+
+class LoadedSnapshot:
+    """One snapshot generation loaded into memory and shared read-only.
+
+    Every session and rerun gets the same instance (see ``SnapshotCache``),
+    so callers must copy before mutating any frame. ``df_datasets`` follows
+    ``DATASET_DTYPES``: org columns are categoricals, so org filters
+    compare integer codes, and missing timestamps are NaT.
+    """
+
+    DATASET_COLUMNS = ["id", "name", "title", "org_id", "metadata_modified", "views", "num_resources"]
+    FIELD_WEIGHTS = (3.0, 1.0, 2.0, 1.0, 1.0)  # title, organization, tags, resource names, notes
+
+    def __init__(self, store, manifest, key):
+        self.store = store
+        self.manifest = manifest
+        self.key = key
+        self._tables = {}
+        self._derived = {}
+        self._lock = threading.Lock()
+        self._derive_locks = {}
+        # Per snapshot, so cached masks never outlive their rows
+        self.filter_mask = functools.lru_cache(maxsize=128)(self._filter_mask)
+        # Reruns for the same query (widget changes) reuse their excerpts
+        self._row_snippet = functools.lru_cache(maxsize=SNIPPET_ROWS * 64)(self._build_snippet)
+        datasets = self.table("datasets", columns=self.DATASET_COLUMNS)
+        orgs = self.table("orgs")
+        org_title_map = dict(zip(orgs["name"], orgs["title"]))
+        self.df_datasets = pd.DataFrame({
+            "title": datasets["title"],
+            "name": datasets["name"],
+            "organization": datasets["org_id"].map(org_title_map).fillna("—"),
+            "org_id": datasets["org_id"],
+            "resources": datasets["num_resources"],
+            "last_modified": pd.to_datetime(datasets["metadata_modified"], utc=True, format="ISO8601"),
+            "views": datasets["views"],
+        }).astype(DATASET_DTYPES)
+
+    def table(self, name, columns=None):
+        """Read a snapshot table once (per column selection) and keep it."""
+        cache_key = (name, tuple(columns) if columns else None)
+        with self._lock:
+            if cache_key not in self._tables:
+                self._tables[cache_key] = self.store.read(name, columns=columns, manifest=self.manifest)
+            return self._tables[cache_key]
+
+    def _derive(self, name, build):
+        """Compute ``build()`` once per snapshot and keep it.
+
+        Each name builds under its own lock, so a slow index build never
+        holds up lookups of tables or other derived data.
+        """
+        with self._lock:
+            lock = self._derive_locks.setdefault(name, threading.Lock())
+        with lock:
+            if name not in self._derived:
+                self._derived[name] = build()
+            return self._derived[name]
+
+    def warm(self):
+        """Build the search, full-text and facet indexes ahead of the first query."""
+        self.search_index
+        self.fulltext_index
+        self.facets
+
+    def _rows(self, dataset_ids):
+        """Positions in ``df_datasets`` of ``dataset_ids`` (-1 if unknown)."""
+        index = self._derive("id_index", lambda: pd.Index(self.table("datasets", columns=self.DATASET_COLUMNS)["id"]))
+        return index.get_indexer(dataset_ids)
+
+    @property
+    def dataset_tags(self):
+        """One ``(row, tag)`` per dataset tag; ``row`` indexes ``df_datasets``."""
+        def build():
+            tags = self.table("tags")
+            rows = self._rows(tags["dataset_id"])
+            known = rows >= 0
+            return pd.DataFrame({
+                "row": rows[known].astype("int32"),
+                "tag": pd.Categorical(tags["tag"].to_numpy()[known]),
+            })
+        return self._derive("dataset_tags", build)
+
+    @property
+    def dataset_resources(self):
+        """One ``(row, name, format)`` per resource; formats upper-cased and categorical."""
+        def build():
+            resources = self.table("resources")
+            rows = self._rows(resources["dataset_id"])
+            known = rows >= 0
+            # Normalize the few distinct spellings, not every row
+            codes, uniques = pd.factorize(resources["format"].fillna("unknown").to_numpy()[known])
+            upper_codes, formats = pd.factorize(pd.Index(uniques).str.upper())
+            return pd.DataFrame({
+                "row": rows[known].astype("int32"),
+                "name": resources["name"].to_numpy()[known],
+                "format": pd.Categorical.from_codes(upper_codes[codes], categories=formats),
+            })
+        return self._derive("dataset_resources", build)
+
+    def org_mask(self, org_id):
+        """Boolean mask over ``df_datasets`` rows owned by ``org_id``."""
+        org_ids = self.df_datasets["org_id"]
+        if org_id not in org_ids.cat.categories:
+            return np.zeros(len(org_ids), dtype=bool)
+        return org_ids.cat.codes.to_numpy() == org_ids.cat.categories.get_loc(org_id)
 
-    data = _search_datasets_paginated_reliable(limit=limit)
+    def _filter_mask(self, filters):
+        """Boolean mask over ``df_datasets`` rows passing every ``QueryFilter``.
+
+        Read-only: masks are shared through the cache on ``filter_mask``.
+        """
+        mask = np.ones(len(self.df_datasets), dtype=bool)
+        for query_filter in filters:
+            matched = self._field_mask(query_filter)
+            mask &= ~matched if query_filter.negate else matched
+        mask.flags.writeable = False
+        return mask
+
+    def _field_mask(self, query_filter):
+        field, op, values = query_filter.field, query_filter.op, query_filter.values
+        mask = np.zeros(len(self.df_datasets), dtype=bool)
+        if field == "org":
+            # Match the slug exactly or the normalized title as a substring
+            org_ids = self.df_datasets["org_id"]
+            title_keys = self._derive("org_title_keys", lambda: {
+                name: _search_key(title) for name, title in zip(self.table("orgs")["name"], self.table("orgs")["title"])
+            })
+            wanted = [
+                code for code, slug in enumerate(org_ids.cat.categories)
+                if any(v.casefold() == slug.casefold() or _search_key(v) in title_keys.get(slug, "") for v in values)
+            ]
+            return np.isin(org_ids.cat.codes.to_numpy(), wanted)
+        if field in ("tag", "format"):
+            table = self.dataset_tags if field == "tag" else self.dataset_resources
+            column = table[field]
+            wanted_values = {v.casefold() for v in values}
+            wanted = [code for code, value in enumerate(column.cat.categories) if value.casefold() in wanted_values]
+            mask[table["row"].to_numpy()[np.isin(column.cat.codes.to_numpy(), wanted)]] = True
+            return mask
+        if field == "modified":
+            modified = self.df_datasets["last_modified"]
+            for v in values:
+                period = pd.Period(v)
+                start = period.start_time.tz_localize("UTC")
+                end = period.end_time.tz_localize("UTC")
+                bounds = {
+                    "=": (modified >= start) & (modified <= end), ">": modified > end,
+                    ">=": modified >= start, "<": modified < start, "<=": modified <= end,
+                }
+                mask |= bounds[op].to_numpy()
+            return mask
+        column = self.df_datasets[field].fillna(0).to_numpy()
+        compare = {"=": operator.eq, ">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le}[op]
+        for v in values:
+            mask |= compare(column, int(v))
+        return mask
+
+    @property
+    def facets(self):
+        """``{label: FacetIndex}`` for the Explorer's facet filters."""
+        def build():
+            size = len(self.df_datasets)
+            rows = np.arange(size)
+            org_ids = self.df_datasets["org_id"]
+            org_titles = dict(zip(self.table("orgs")["name"], self.table("orgs")["title"]))
+            titles = [org_titles.get(slug) or slug for slug in org_ids.cat.categories]
+            # Two orgs may share a title; labels must stay unique
+            duplicated = pd.Index(titles).duplicated(keep=False)
+            org_labels = [f"{title} ({slug})" if dup else title for title, slug, dup in zip(titles, org_ids.cat.categories, duplicated)]
+            licenses = pd.Categorical(self.table("datasets", columns=["license_id"])["license_id"].fillna("unspecified"))
+            years = self.df_datasets["last_modified"].dt.year.astype("Int64")
+            # Newest year first, undated rows last
+            year_labels = [str(year) for year in sorted(years.dropna().unique(), reverse=True)] + ["unknown"]
+            years = pd.Categorical(years.astype("string").fillna("unknown").to_numpy(), categories=year_labels)
+            tags, resources = self.dataset_tags, self.dataset_resources
+            return {
+                "Organization": FacetIndex(rows, org_ids.cat.codes, org_labels, size),
+                "Tag": FacetIndex(tags["row"], tags["tag"].cat.codes, list(tags["tag"].cat.categories), size),
+                "Format": FacetIndex(
+                    resources["row"], resources["format"].cat.codes, list(resources["format"].cat.categories), size
+                ),
+                "License": FacetIndex(rows, licenses.codes, list(licenses.categories), size),
+                "Modified": FacetIndex(rows, years.codes, year_labels, size, keep_order=True),
+            }
+        return self._derive("facets", build)
+
+    def memory_report(self):
+        """Bytes held by each ``df_datasets`` column, largest first."""
+        usage = self.df_datasets.memory_usage(deep=True, index=False)
+        return pd.DataFrame({
+            "dtype": self.df_datasets.dtypes.astype(str),
+            "MiB": (usage / 2**20).round(2),
+        }).sort_values("MiB", ascending=False)
+
+    @property
+    def search_index(self):
+        """``TrigramIndex`` over the precomputed ``search_key`` column."""
+        return self._derive("search_index", lambda: TrigramIndex(self._read_keys(["search_key"])["search_key"]))
+
+    @property
+    def fulltext_index(self):
+        """``BM25Index`` over title, organization, tags, resource names and notes."""
+        def build():
+            keys = self._read_keys(["search_key", "text_key"])
+            title_org = keys["search_key"].str.rsplit("\n", n=1, expand=True).reindex(columns=[0, 1]).fillna("")
+            text = keys["text_key"].str.split(FIELD_SEPARATOR, n=2, expand=True).reindex(columns=[0, 1, 2]).fillna("")
+            docs = zip(title_org[0], title_org[1], text[0], text[1], text[2])
+            return BM25Index(docs, self.FIELD_WEIGHTS)
+        return self._derive("fulltext_index", build)
+
+    def _read_keys(self, columns):
+        # Read uncached: the keys only live on inside the indexes
+        return self.store.read("datasets", columns=columns, manifest=self.manifest).fillna("")
+
+    def search(self, query):
+        """Row ids matching ``query``, most relevant first.
+
+        Full-text hits come first in BM25 order, followed by rows whose
+        title or organization only contains the query as a substring.
+        """
+        ranked, _ = self.fulltext_index.search(_index_terms(" ".join(_query_terms(query))))
+        substring = np.flatnonzero(self.search_mask(query))
+        return np.concatenate([ranked, np.setdiff1d(substring, ranked)]).astype(np.int64)
+
+    def snippets(self, rows, query, mark=("**", "**")):
+        """Notes excerpt around the first match of ``query`` for each of ``rows``."""
+        terms = _query_terms(query)
+        return [self._row_snippet(int(row), terms, mark) for row in rows]
+
+    def _build_snippet(self, row, terms, mark):
+        notes = self.table("datasets", columns=["notes"])["notes"]
+        return _snippet(notes.iat[row], terms, mark=mark)
+
+    def search_mask(self, query):
+        """Boolean mask over ``df_datasets`` rows containing every term of ``query``."""
+        mask = np.ones(len(self.df_datasets), dtype=bool)
+        for term in _query_terms(query):
+            hits = np.zeros_like(mask)
+            hits[self.search_index.search(term)] = True
+            mask &= hits
+        return mask
+
+    @property
+    def tag_counts(self):
+        """Datasets per tag, most used first."""
+        return self._derive("tag_counts", lambda: self.dataset_tags["tag"].value_counts())
+
+    @property
+    def format_counts(self):
+        """Resources per format, most used first."""
+        return self._derive("format_counts", lambda: self.dataset_resources["format"].value_counts())
+
+def _file_signature(path):
     try:
-        with open(cache_file, "w", encoding="utf-8") as f:
-            json.dump(data, f)
-    except:
-        pass
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (path, stat.st_mtime_ns, stat.st_size)
+
+class SnapshotCache:
+    """Process-wide holder of the current ``LoadedSnapshot``.
+
+    Keyed on the path, mtime and size of the store's ``CURRENT`` manifest:
+    reruns reuse the loaded tables until a refresh publishes a new
+    generation, which is then loaded once and swapped in atomically.
+    Indexes are never built inside a session's rerun: ``prepare`` builds
+    them before the swap, and ``get`` builds them on a side thread.
+    """
 
-    return data if data else []
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._preparing = None
 
-@st.cache_data(ttl=3600)
-def get_all_org_details_parallel(max_threads=20):
+    def get(self, store):
+        key = _file_signature(store.current_path)
+        snapshot = self._snapshot
+        # While ``prepare`` readies this generation, keep serving the previous one
+        if snapshot is not None and key in (snapshot.key, self._preparing):
+            return snapshot
+        with self._lock:
+            if self._snapshot is None or self._snapshot.key != key:
+                manifest = store.manifest()
+                if manifest is None:
+                    return None
+                self._snapshot = LoadedSnapshot(store, manifest, key)
+                threading.Thread(target=self._snapshot.warm, name="ckan-snapshot-index", daemon=True).start()
+            return self._snapshot
+
+    def prepare(self, store):
+        """Load and index the current generation, then swap it in."""
+        key = _file_signature(store.current_path)
+        with self._lock:
+            if self._snapshot is not None and self._snapshot.key == key:
+                return
+            self._preparing = key
+        try:
+            manifest = store.manifest()
+            if manifest is None:
+                return
+            snapshot = LoadedSnapshot(store, manifest, key)
+            snapshot.warm()
+            with self._lock:
+                if self._snapshot is None or self._snapshot.key != key:
+                    self._snapshot = snapshot
+        finally:
+            self._preparing = None
+
+@st.cache_resource
+def get_snapshot_cache():
+    return SnapshotCache()
+
+def _snapshot_tables(rows, orgs):
+    """Split ``DatasetRecord``s into snapshot tables."""
+    datasets, resources, tags = [], [], []
+    org_titles = {org["name"]: org["title"] for org in orgs}
+    for d in rows:
+        org = d.organization
+        if org and org.title:
+            org_titles.setdefault(org.name, org.title)
+        datasets.append((
+            d.id, d.name, d.title, d.notes, d.license_id, org.name if org else None, d.metadata_modified,
+            d.views, len(d.resources), None, None,
+        ))
+        resources.extend((d.id, r.name, r.format) for r in d.resources)
+        tags.extend((d.id, t) for t in d.tags)
+    return {
+        "datasets": pd.DataFrame(datasets, columns=SNAPSHOT_COLUMNS["datasets"]),
+        "resources": pd.DataFrame(resources, columns=SNAPSHOT_COLUMNS["resources"]),
+        "tags": pd.DataFrame(tags, columns=SNAPSHOT_COLUMNS["tags"]),
+        "orgs": pd.DataFrame(list(org_titles.items()), columns=SNAPSHOT_COLUMNS["orgs"]),
+    }
+
+class SnapshotBuilder:
+    """Collects crawled pages as snapshot tables, one small set per page.
+
+    Each page is split into columns as soon as it arrives, so at most one
+    page of row dicts per fetch worker is alive at a time. ``tables``
+    stitches the pages together in page order. ``finished`` is set once
+    the crawl has every page it set out to fetch.
+    """
+
+    def __init__(self):
+        self._pages = {}
+        self.num_rows = 0
+        self.finished = False
+
+    def __contains__(self, page):
+        return page in self._pages
+
+    @property
+    def num_pages(self):
+        return len(self._pages)
+
+    def add_page(self, page, rows):
+        self.truncate(page, page + 1)
+        self._pages[page] = _snapshot_tables(rows, ())
+        self.num_rows += len(self._pages[page]["datasets"])
+
+    def truncate(self, start, stop=None):
+        """Drop pages ``start`` up to (not including) ``stop``, or to the end."""
+        for page in [p for p in self._pages if p >= start and (stop is None or p < stop)]:
+            self.num_rows -= len(self._pages.pop(page)["datasets"])
+
+    def tables(self, orgs):
+        """Concatenated tables; a dataset seen on two pages keeps its later copy."""
+        order = sorted(self._pages)
+        merged = {}
+        for name in ("datasets", "resources", "tags"):
+            frames = [self._pages[page][name].assign(_page=page) for page in order if len(self._pages[page][name])]
+            merged[name] = (pd.concat(frames, ignore_index=True) if frames
+                            else pd.DataFrame(columns=SNAPSHOT_COLUMNS[name] + ["_page"]))
+        # Child rows follow whichever copy of their dataset survived
+        datasets = merged["datasets"].drop_duplicates("id", keep="last")
+        owner = pd.Series(datasets["_page"].values, index=datasets["id"])
+        merged["datasets"] = datasets
+        for name in ("resources", "tags"):
+            child = merged[name]
+            merged[name] = child[child["dataset_id"].map(owner) == child["_page"]]
+        for name in ("datasets", "resources", "tags"):
+            merged[name] = merged[name].drop(columns="_page").reset_index(drop=True)
+        org_frames = [_snapshot_tables((), orgs)["orgs"]] + [self._pages[page]["orgs"] for page in order]
+        merged["orgs"] = pd.concat(org_frames, ignore_index=True).drop_duplicates("name").reset_index(drop=True)
+        return merged
+
+def _merge_snapshot_tables(old, new):
+    """Replace every dataset present in ``new`` (by id) and append the rest."""
+    changed = new["datasets"]["id"]
+    merged = {}
+    for name, key in (("datasets", "id"), ("resources", "dataset_id"), ("tags", "dataset_id")):
+        kept = old[name][~old[name][key].isin(changed)]
+        merged[name] = pd.concat([kept, new[name]], ignore_index=True)
+    merged["orgs"] = pd.concat([new["orgs"], old["orgs"]], ignore_index=True).drop_duplicates("name")
+    return merged
+
+def _watermark(datasets):
+    modified = datasets["metadata_modified"].dropna()
+    return modified.max() if len(modified) else None
+
+def _sync_snapshot(store, manifest, reporter=None):
+    """Merge datasets modified since the snapshot's watermark into it.
+
+    Returns the new manifest, ``manifest`` itself when nothing changed or
+    the fetch failed outright, or None when a full reload is needed (no
+    watermark, an incomplete snapshot whose crawl should be resumed, or
+    the merged count disagrees with CKAN, e.g. because datasets were
+    deleted).
+    """
+    watermark = manifest.get("watermark")
+    if not watermark or not manifest.get("complete", True):
+        return None
+    reporter = reporter or StreamlitCrawlReporter()
+    changed = _search_datasets_paginated_reliable(
+        limit=None, fq=f"metadata_modified:[{_solr_date(watermark)} TO *]", reporter=reporter
+    )
+    if not changed.num_rows and not changed.finished:
+        return manifest
+    changed = changed.tables(get_org_metadata())
+    # The filter is inclusive, so the watermark row itself always comes back
+    modified = changed["datasets"]["metadata_modified"].dropna().map(_solr_date)
+    if not (modified > _solr_date(watermark)).any():
+        merged = None
+        count = manifest.get("count")
+    else:
+        old = {name: store.read(name, manifest=manifest) for name in SNAPSHOT_COLUMNS}
+        merged = _fill_search_keys(_merge_snapshot_tables(old, changed))
+        count = len(merged["datasets"])
+    live_count = _search_count()
+    if live_count != count:
+        reporter.warning(f"⚠️ Synced {count:,} datasets but CKAN reports {live_count}; doing a full reload.")
+        return None
+    if merged is None:
+        return manifest
+    return store.write(
+        merged, watermark=_watermark(merged["datasets"]), count=len(merged["datasets"]),
+        expected=live_count, complete=True,
+    )
+
+def _migrate_legacy_cache(store):
+    """Import a pre-snapshot dataset_cache.json, if present, and delete it."""
+    try:
+        with open(LEGACY_CACHE_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    finally:
+        if os.path.exists(LEGACY_CACHE_FILE):
+            os.remove(LEGACY_CACHE_FILE)
+    rows = []
+    for d in data["datasets"] if isinstance(data, dict) else data:
+        try:
+            rows.append(DatasetRecord.decode(d))
+        except (TypeError, ValueError, AttributeError):
+            continue
+    if not rows:
+        return None
+    tables = _fill_search_keys(_snapshot_tables(rows, get_org_metadata()))
+    return store.write(tables, watermark=_watermark(tables["datasets"]), count=len(rows))
+
+def _crawl_snapshot(store, limit=None, reporter=None, fresh=False):
+    """Crawl the whole catalog into a new snapshot generation.
+
+    Returns None if nothing came back, or if the crawl is incomplete and a
+    complete generation is already being served. ``fresh`` discards any
+    checkpoint first, so every page is refetched.
+    """
+    reporter = reporter or StreamlitCrawlReporter()
+    if fresh:
+        CrawlCheckpoint.discard()
+    builder = _search_datasets_paginated_reliable(limit=limit, reporter=reporter)
+    if not builder.num_rows:
+        return None
+    # Resumed or offset crawls can see a dataset twice if it moved meanwhile;
+    # the builder keeps one copy
+    tables = _fill_search_keys(builder.tables(get_org_metadata()))
+    count = len(tables["datasets"])
+    expected = _search_count()
+    complete = count == expected
+    # Keep the checkpoint only while pages are missing. With none missing, a
+    # surplus or shortfall means rows moved between pages, and resuming would
+    # just republish the same snapshot
+    if complete or expected is None or count > expected or builder.finished:
+        CrawlCheckpoint.discard()
+    current = store.manifest()
+    if not complete and current is not None and current.get("complete", True):
+        reporter.warning(f"⚠️ Crawl got {count:,} of {expected} datasets; keeping the current snapshot.")
+        return None
+    return store.write(
+        tables, watermark=_watermark(tables["datasets"]), count=count,
+        expected=expected, complete=complete,
+    )
+
+def search_datasets_paginated(limit=None):
+    """Return ``(store, manifest)`` for the catalog snapshot, crawling if needed.
+
+    ``manifest`` is None if no snapshot exists and the crawl returned nothing.
+    """
+    store = SnapshotStore()
+
+    # A refresh recrawls but keeps serving the current snapshot to other
+    # sessions until the new generation is published.
+    force_crawl = st.session_state.refresh_cache
+    if force_crawl:
+        st.session_state.refresh_cache = False
+        if os.path.exists(ORG_CACHE_FILE):
+            os.remove(ORG_CACHE_FILE)
+        st.cache_data.clear()
+
+    manifest = store.manifest()
+    if manifest is None and os.path.exists(LEGACY_CACHE_FILE):
+        manifest = _migrate_legacy_cache(store)
+
+    if st.session_state.sync_cache:
+        st.session_state.sync_cache = False
+        if manifest is not None:
+            manifest = _coalesced("sync", _sync_snapshot, store, manifest)
+            force_crawl = manifest is None
+
+    if manifest is None or force_crawl:
+        # A manual refresh starts over instead of resuming a checkpoint
+        manifest = _coalesced("crawl", _crawl_snapshot, store, limit, None, force_crawl) or manifest
+
+    return store, manifest
+
+def _org_summary(org):
+    return {
+        "name": org.get("name"),  # stable slug
+        "title": org.get("title") or org.get("display_name") or org.get("name")  # fallback to readable
+    }
+
+def _fetch_orgs_bulk(page_size=ORG_PAGE_SIZE):
+    """Page through ``organization_list?all_fields=true``.
+
+    Returns None if the server does not support it (error, or slugs instead
+    of dicts) so the caller can fall back to the per-org fan-out. Paging
+    stops on an empty page or one with nothing new, since servers clamp
+    ``limit`` (25 by default) or may ignore ``offset`` entirely; in the
+    latter case the result falls short of the plain slug list and None is
+    returned as well.
+    """
+    client = get_ckan_client()
+    orgs = {}
+    offset = 0
+    while True:
+        try:
+            r = client.action("organization_list", {"all_fields": "true", "limit": page_size, "offset": offset})
+        except requests.RequestException:
+            return None
+        if r.status_code != 200:
+            return None
+        page = r.json()["result"]
+        if page and not isinstance(page[0], dict):
+            return None
+        new = [o for o in page if o.get("name") not in orgs]
+        if not new:
+            break
+        orgs.update((o["name"], _org_summary(o)) for o in new)
+        offset += len(page)
+    if len(orgs) < len(get_organizations()):
+        return None
+    return list(orgs.values())
+
+def get_all_org_details_parallel(max_threads=ORG_DETAIL_THREADS):
     org_ids = get_organizations()  # CKAN returns list of slugs (org "name")
+    client = get_ckan_client()
     org_details = []
 
     def fetch_detail(org_id):
         try:
-            r = requests.get(
-                f"{CKAN_URL}/api/3/action/organization_show?id={org_id}",
-                headers=headers,
-                timeout=8
-            )
+            r = client.action("organization_show", {"id": org_id}, timeout=8)
             if r.status_code == 200:
-                org = r.json()["result"]
-                return {
-                    "name": org.get("name"),  # stable slug
-                    "title": org.get("title") or org.get("display_name") or org.get("name")  # fallback to readable
-                }
+                return _org_summary(r.json()["result"])
         except:
             return None
         return None
@@ -157,29 +1924,127 @@ def get_all_org_details_parallel(max_threads=20):
 
     return org_details
 
+def _load_org_metadata():
+    if os.path.exists(ORG_CACHE_FILE) and time.time() - os.path.getmtime(ORG_CACHE_FILE) < ORG_CACHE_TTL:
+        try:
+            with open(ORG_CACHE_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except:
+            pass
+
+    orgs = _fetch_orgs_bulk()
+    if orgs is None:
+        orgs = get_all_org_details_parallel()
+    if orgs:
+        try:
+            with open(ORG_CACHE_FILE, "w", encoding="utf-8") as f:
+                json.dump(orgs, f)
+        except:
+            pass
+    return orgs
+
+@st.cache_data(ttl=ORG_CACHE_TTL)
+def get_org_metadata():
+    """Name/title for every organization, via one or two bulk requests.
+
+    Persisted to ``ORG_CACHE_FILE`` so restarts within the TTL skip CKAN;
+    falls back to the organization_show fan-out on servers without
+    ``all_fields`` support. Concurrent cache misses share one load.
+    """
+    return get_single_flight().do("orgs", _load_org_metadata)
+
+# === BACKGROUND REFRESH ===
+class BackgroundRefresher:
+    """Daemon thread that keeps the snapshot fresh without blocking any session.
+
+    Runs at startup and then every ``interval`` seconds: an incremental sync
+    when a snapshot exists, a full crawl when there is none or the sync
+    cannot be reconciled. Sessions keep serving the previous generation
+    until the new one is published and indexed, and share in-flight work
+    with it through ``SingleFlight``.
+    """
+
+    RETRY_DELAY = 300  # seconds before retrying a failed refresh
+
+    def __init__(self, store, interval, flight, snapshots):
+        self.store = store
+        self.interval = interval
+        self.flight = flight
+        self.snapshots = snapshots
+        self.last_finished = None
+        self.last_errors = []
+        self._thread = threading.Thread(target=self._run, name="ckan-snapshot-refresh", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            ok = self.refresh()
+            # Incomplete snapshots are retried sooner; the crawl resumes from its checkpoint
+            time.sleep(self.interval if ok else min(self.interval, self.RETRY_DELAY))
+
+    def refresh(self):
+        reporter = LogCrawlReporter()
+        manifest = None
+        try:
+            current = self.store.manifest()
+            if current is not None:
+                manifest = self.flight.do("sync", _sync_snapshot, self.store, current, reporter)
+            if manifest is None:
+                manifest = self.flight.do("crawl", _crawl_snapshot, self.store, None, reporter)
+            if manifest is not None:
+                self.snapshots.prepare(self.store)
+        except Exception as e:
+            reporter.error(f"❌ Background refresh failed: {e}")
+        self.last_finished = time.time()
+        self.last_errors = reporter.errors
+        return manifest is not None and manifest.get("complete", True)
+
+@st.cache_resource
+def get_background_refresher():
+    if REFRESH_INTERVAL <= 0:
+        return None
+    return BackgroundRefresher(SnapshotStore(), REFRESH_INTERVAL, get_single_flight(), get_snapshot_cache())
+
 # === DATA LOADING ===
-datasets = get_datasets()
-orgs = get_organizations()
+refresher = get_background_refresher()
+orgs = get_org_metadata()
 
 # Build dataset details + index
 with st.spinner("🔄 Fetching dataset list from CKAN..."):
-    dataset_data = search_datasets_paginated(limit=10000)
-st.success(f"✅ Loaded {len(dataset_data):,} datasets.")
-if not dataset_data:
+    snapshot_store, snapshot_manifest = search_datasets_paginated()
+snapshot = get_snapshot_cache().get(snapshot_store) if snapshot_manifest else None
+if snapshot is None:
     st.error("❌ No datasets returned. Please try refreshing or check your CKAN connection.")
     st.stop()  # Halts Streamlit execution safely
-df_datasets = pd.DataFrame([{
-    "title": d.get("title"),
-    "name": d.get("name"),
-    "organization": d.get("organization", {}).get("title", "—"),
-    "org_id": d.get("organization", {}).get("name", "unknown"),
-    "resources": len(d.get("resources", [])),
-    "last_modified": d.get("metadata_modified", "—"),
-    "views": d.get("tracking_summary", {}).get("total", 0)
-} for d in dataset_data])
-
-# Build org summary
-org_dataset_count = df_datasets["organization"].value_counts().to_dict()
+st.success(f"✅ Loaded {snapshot.manifest['count']:,} datasets.")
+if refresher is not None:
+    snapshot_age = int(time.time() - snapshot.manifest["created_at"]) // 60
+    if refresher.last_finished is None:
+        last_check = "first check in progress"
+    else:
+        last_check = f"last checked {int(time.time() - refresher.last_finished) // 60} min ago"
+    st.caption(
+        f"🕒 Snapshot built {snapshot_age} min ago; refreshed in the background every "
+        f"{REFRESH_INTERVAL // 60} min ({last_check})."
+    )
+    if refresher.last_errors:
+        st.warning(f"⚠️ Last background refresh had problems: {refresher.last_errors[-1]}")
+if not snapshot.manifest.get("complete", True):
+    st.warning(
+        f"⚠️ Snapshot is incomplete ({snapshot.manifest['count']:,} of {snapshot.manifest['expected'] or 0:,} datasets); "
+        "the missing pages are fetched on the next refresh."
+    )
+df_datasets = snapshot.df_datasets
+
+# Build org summary: one facet query when available, else count locally
+facets = get_search_facets() if OVERVIEW_AGGREGATION == "facets" else None
+if facets:
+    org_dataset_count = {
+        item.get("display_name") or item["name"]: item["count"] for item in facets["organization"]
+    }
+else:
+    org_counts = df_datasets["organization"].value_counts()
+    org_dataset_count = org_counts[org_counts > 0].to_dict()
 total_views = df_datasets["views"].sum()
 
 # === TABS ===
@@ -189,8 +2054,8 @@ tab1, tab2 = st.tabs(["📊 Overview", "🔍 Explorer"])
 with tab1:
     col1, col2, col3, col4 = st.columns(4)
     col1.metric("🏢 Organizations", len(orgs))
-    col2.metric("📦 Datasets (visible)", len(dataset_data))
-    col3.metric("📦 Datasets (total)", len(datasets))
+    col2.metric("📦 Datasets (visible)", len(df_datasets))
+    col3.metric("📦 Datasets (total)", get_dataset_count())
     col4.metric("👁️ Website Views (tracked)", total_views)
 
     sort_option = st.selectbox(
@@ -219,19 +2084,20 @@ with tab1:
     st.altair_chart(bar_chart, use_container_width=True)
 
     st.markdown("### 🏷️ Top Tags")
-    all_tags = []
-    all_formats = []
-
-    for d in dataset_data:
-        tags = d.get("tags", [])
-        all_tags += [t["name"] for t in tags if "name" in t]
-    
-        resources = d.get("resources", [])
-        all_formats += [r.get("format", "unknown").upper() for r in resources]
-
-    # Count top 10 tags
-    tag_series = pd.Series(all_tags).value_counts().head(10)
-    format_series = pd.Series(all_formats).value_counts().head(10)
+    if facets:
+        tag_series = pd.Series(
+            {item["name"]: item["count"] for item in facets["tags"]}, dtype="int64"
+        ).sort_values(ascending=False).head(10)
+        # Facets count datasets per format (not resources); merge case variants
+        format_series = pd.Series(
+            [item["count"] for item in facets["res_format"]],
+            index=[(item["name"] or "unknown").upper() for item in facets["res_format"]],
+            dtype="int64",
+        ).groupby(level=0).sum().sort_values(ascending=False).head(10)
+    else:
+        # Counted once per snapshot
+        tag_series = snapshot.tag_counts.head(10)
+        format_series = snapshot.format_counts.head(10)
 
     col_tag, col_format = st.columns(2)
 
@@ -257,16 +2123,23 @@ with tab1:
 
     with col_format:
         st.altair_chart(format_chart, use_container_width=True)
-        st.caption("Top 10 Resource Formats")
+        st.caption("Top 10 Resource Formats" + (" (datasets per format)" if facets else ""))
 
 
 # === TAB 2: EXPLORER ===
 with tab2:
     st.markdown("### 🔍 Dataset Explorer")
 
-    search = st.text_input("🔎 Search datasets or organizations", "")
+    search = st.text_input(
+        "🔎 Search datasets or organizations", "",
+        help="Free text, optionally with filters: org:moph format:csv,xlsx tag:covid "
+             "modified:>2024-01-01 views:>100 resources:0 (prefix - to exclude)",
+    )
+    query = parse_query(search)
+    if query.errors:
+        st.warning("⚠️ Ignored invalid filter(s): " + "; ".join(query.errors))
     
-    all_orgs = get_all_org_details_parallel()
+    all_orgs = get_org_metadata()
     org_titles = [org["title"] for org in all_orgs]
     org_id_map = {org["title"]: org["name"] for org in all_orgs}
     org_filter = st.selectbox(
@@ -274,18 +2147,37 @@ with tab2:
         ["All"] + sorted(org_titles)
     )
 
-    filtered_df = df_datasets.copy()
-    
+    # Row ids in display order: by relevance when searching
+    rows = snapshot.search(query.text) if query.text else np.arange(len(df_datasets))
+    if query.filters:
+        rows = rows[snapshot.filter_mask(query.filters)[rows]]
     if org_filter != "All":
-        org_id = org_id_map[org_filter]
-        filtered_df = filtered_df[filtered_df["org_id"] == org_id]
+        rows = rows[snapshot.org_mask(org_id_map[org_filter])[rows]]
 
-    if search:
-        search_lower = search.lower()
-        filtered_df = filtered_df[
-            filtered_df["title"].str.lower().str.contains(search_lower) |
-            filtered_df["organization"].str.lower().str.contains(search_lower)
-        ]
+    # Facets: counts reflect the rows above and every other facet's selection
+    explorer_facets = snapshot.facets
+    selected = {
+        name: [v for v in st.session_state.get(f"facet_{name}", []) if v in facet.values]
+        for name, facet in explorer_facets.items()
+    }
+    in_view = np.zeros(len(df_datasets), dtype=bool)
+    in_view[rows] = True
+    in_view = np.packbits(in_view)
+    selections = {name: explorer_facets[name].select(values) for name, values in selected.items() if values}
+    with st.expander("🧭 Facets", expanded=bool(selections)):
+        for column, (name, facet) in zip(st.columns(len(explorer_facets)), explorer_facets.items()):
+            context = functools.reduce(np.bitwise_and, [bits for other, bits in selections.items() if other != name], in_view)
+            counts = dict(zip(facet.values, facet.counts(context)))
+            column.multiselect(
+                name, [v for v in facet.values if counts[v] or v in selected[name]],
+                # default keeps the choice on Streamlit versions that re-key widgets when options change
+                default=selected[name], key=f"facet_{name}",
+                format_func=lambda v, counts=counts: f"{v} ({counts[v]:,})",
+            )
+    if selections:
+        chosen = np.unpackbits(functools.reduce(np.bitwise_and, selections.values()), count=len(df_datasets)).astype(bool)
+        rows = rows[chosen[rows]]
+    filtered_df = df_datasets.iloc[rows]
 
     # Build a clean preview DataFrame with download links
     
@@ -301,19 +2193,28 @@ with tab2:
     if view_mode == "Table":
         st.write(f"🔎 Showing **{len(filtered_df_display)}** dataset(s)")
 
+        columns = ["title", "organization", "resources", "last_modified", "views", "Dataset Link"]
+        if query.text:
+            top = rows[:SNIPPET_ROWS]
+            filtered_df_display["match"] = snapshot.snippets(top, query.text, mark=("«", "»")) + [""] * (len(rows) - len(top))
+            columns.insert(1, "match")
         st.dataframe(
-            filtered_df_display[["title", "organization", "resources", "last_modified", "views", "Dataset Link"]],
+            filtered_df_display[columns],
             use_container_width=True
         )
     
     elif view_mode == "Detail (Markdown)":
         st.write(f"🔎 Showing **{len(filtered_df_display)}** dataset(s)")
-        for _, row in filtered_df_display.iterrows():
+        snippets = snapshot.snippets(rows[:SNIPPET_ROWS], query.text) if query.text else []
+        for i, (_, row) in enumerate(filtered_df_display.iterrows()):
+            modified = row["last_modified"].strftime("%Y-%m-%d %H:%M UTC") if pd.notna(row["last_modified"]) else "—"
+            # Notes are rendered with unsafe_allow_html, so escape them
+            snippet = f"- 📝 {html.escape(snippets[i], quote=False)}\n            " if i < len(snippets) and snippets[i] else ""
             st.markdown(f"""
             #### 📦 {row['title']}
-            - 🏢 Org: {row['organization']}
+            {snippet}- 🏢 Org: {row['organization']}
             - 🗂️ Resources: {row['resources']}
-            - 🕒 Last modified: {row['last_modified']}
+            - 🕒 Last modified: {modified}
             - 👁️ Views: {row['views']}
             - 🔗 Dataset: {make_download_link(row)}
             <hr style="margin:10px 0;">
@@ -321,4 +2222,17 @@ with tab2:
     #st.dataframe(
     #    filtered_df_display[["title", "organization", "resources", "last_modified", "views", "Download Links"]],
     #    use_container_width=True
-    #    )
\ No newline at end of file
+    #    )
+
+# === SIDEBAR: CKAN TRAFFIC ===
+with st.sidebar.expander("📈 CKAN traffic (this process)"):
+    traffic = get_ckan_client().limiter.metrics()
+    if traffic:
+        st.dataframe(pd.DataFrame(traffic).T, use_container_width=True)
+    else:
+        st.caption("No CKAN requests yet.")
+
+with st.sidebar.expander("🧮 Dataset table memory"):
+    memory = snapshot.memory_report()
+    st.dataframe(memory, use_container_width=True)
+    st.caption(f"Total: {memory['MiB'].sum():.2f} MiB for {len(df_datasets):,} rows")